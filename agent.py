@@ -6,40 +6,90 @@ from langchain_openai import ChatOpenAI
 # from langgraph.prebuilt import create_react_agent # REMOVE: We are building manually
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
+from mcp.shared.exceptions import McpError
 from langchain_mcp_adapters.tools import load_mcp_tools
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, BaseMessage, SystemMessage # Added BaseMessage, SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages # Helper to add messages to state
-from langgraph.prebuilt import ToolNode # Use prebuilt ToolNode
-from typing import Annotated, Sequence # For state definition
-import operator # For state definition
-import traceback
+from typing import Annotated, Any # For state definition
+from typing_extensions import TypedDict # For state definition
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, field
+import anyio
+import atexit
+import concurrent.futures
+import hashlib
+import json
+import queue
+import threading
+import time
+import logging
+import uuid
+import weakref
 import os
 import datetime
+import functools
 
-# Get current date
-now = datetime.date.today()
 # Map month number to Portuguese name
 month_names_pt = {
     1: "Janeiro", 2: "Fevereiro", 3: "Março", 4: "Abril",
     5: "Maio", 6: "Junho", 7: "Julho", 8: "Agosto",
     9: "Setembro", 10: "Outubro", 11: "Novembro", 12: "Dezembro"
 }
-CURRENT_MONTH_NAME_PT = month_names_pt[now.month]
-CURRENT_YEAR_STR = str(now.year)
 
 
 # Load environment variables from .env file
 load_dotenv()
-MODEL_NAME = "gpt-4.1-mini-2025-04-14" # Model name
+
+# Logging (set LOGLEVEL=DEBUG to see model responses and final states)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+# --- Optional self-hosted model ---
+# Set LOCAL_LLM_BASE_URL to use an OpenAI-compatible server (e.g. vLLM) instead of OpenAI.
+# Tool calling needs to be enabled on the server, for example:
+#   vllm serve meta-llama/Llama-3.1-8B-Instruct-FP8 --quantization fp8 --enable-chunked-prefill \
+#       --max-num-seqs 256 --enable-auto-tool-choice --tool-call-parser llama3_json
+# vLLM batches concurrent requests from all users automatically (continuous batching).
+LOCAL_LLM_BASE_URL = os.environ.get("LOCAL_LLM_BASE_URL") # e.g. "http://localhost:8000/v1"
+LOCAL_LLM_MODEL = os.environ.get("LOCAL_LLM_MODEL", "meta-llama/Llama-3.1-8B-Instruct-FP8")
+MODEL_NAME = LOCAL_LLM_MODEL if LOCAL_LLM_BASE_URL else "gpt-4.1-mini-2025-04-14" # Model name
 SERVER_SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "comexstat.py")
 # --- MOVE CONSTANT HERE ---
-TOOL_LOAD_TIMEOUT = 45.0 # Timeout for MCP operations like init and tool loading
+# Timeouts (seconds) for MCP operations, tunable via environment variables
+MCP_INIT_TIMEOUT = float(os.environ.get("MCP_INIT_TIMEOUT", "10")) # session.initialize()
+MCP_LOAD_TIMEOUT = float(os.environ.get("MCP_LOAD_TIMEOUT", "30")) # load_mcp_tools()
+MCP_READ_TIMEOUT = float(os.environ.get("MCP_READ_TIMEOUT", "300")) # Any single MCP request, e.g. a tool call
+MCP_PING_TIMEOUT = float(os.environ.get("MCP_PING_TIMEOUT", "5")) # Health check before reusing a pooled session
+# Token budget for the messages sent to the model on each agent step (tool results included)
+MAX_HISTORY_TOKENS = int(os.environ.get("MAX_HISTORY_TOKENS", "16000"))
+# Max tool calls running at once against the MCP server
+TOOL_CONCURRENCY = 8
+# Auxiliary-table lookups return static reference data, so their results are cached
+CACHEABLE_TOOLS = frozenset({"fetch_auxiliary_table", "fetch_single_item_detail"})
+TOOL_CACHE_MAXSIZE = 4096
+# Cached results expire like the server-side reference cache (comexstat.py): searched/paged
+# lookups after a minute (in memory only), plain table and item lookups after a day
+TOOL_CACHE_TTL_SHORT = 60
+TOOL_CACHE_TTL_LONG = 24 * 60 * 60
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(os.path.dirname(__file__), ".langchain_cache.db"))
+TOOL_CACHE_DIR = os.environ.get("TOOL_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".tool_cache"))
 
 # --- Custom System Prompt ---
-# Define your custom instructions for the agent here
-CUSTOM_SYSTEM_PROMPT = f"""
+# Define your custom instructions for the agent here. The prompt mentions the current
+# date, so it is rebuilt (at most once per day) instead of being frozen at import.
+@functools.lru_cache(maxsize=1)
+def _build_system_prompt(day_ordinal: int) -> str:
+    """Formats the system prompt for the given date (as date.toordinal())."""
+    now = datetime.date.fromordinal(day_ordinal)
+    CURRENT_MONTH_NAME_PT = month_names_pt[now.month]
+    CURRENT_YEAR_STR = str(now.year)
+    return f"""
 Você é um assistente útil especializado em dados de comércio exterior brasileiro (ComexStat).
 Você tem acesso a ferramentas que podem consultar estatísticas gerais de comércio e procurar códigos em tabelas auxiliares (como países, Grupo CUCI (SITCGroup), blocos econômicos, etc.).
 Quando uma pergunta for feita:
@@ -77,8 +127,30 @@ Conceitos importantes:
 
 
 """
+
+
+def get_system_prompt() -> str:
+    """Returns the system prompt for today."""
+    return _build_system_prompt(datetime.date.today().toordinal())
 # --- End Custom System Prompt ---
 
+# --- Agent Prompt (built once per day) ---
+@functools.lru_cache(maxsize=1)
+def _build_agent_prompt(day_ordinal: int) -> ChatPromptTemplate:
+    """Builds the agent prompt template around the system message for the given date."""
+    system_message = SystemMessage(content=_build_system_prompt(day_ordinal))
+    return ChatPromptTemplate.from_messages(
+        [
+            system_message,
+            MessagesPlaceholder(variable_name="messages"),
+        ]
+    )
+
+
+def get_agent_prompt() -> ChatPromptTemplate:
+    """Returns the agent prompt template for today."""
+    return _build_agent_prompt(datetime.date.today().toordinal())
+
 
 # --- End Configuration ---
 
@@ -90,248 +162,751 @@ if sys.platform == "win32":
         current_policy = asyncio.get_event_loop_policy()
         if not isinstance(current_policy, asyncio.WindowsProactorEventLoopPolicy):
             asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-            print("Setting WindowsProactorEventLoopPolicy for asyncio.")
+            logger.info("Setting WindowsProactorEventLoopPolicy for asyncio.")
         else:
-            print("WindowsProactorEventLoopPolicy already set.")
+            logger.info("WindowsProactorEventLoopPolicy already set.")
     except Exception as e:
         st.error(f"Failed to set asyncio policy: {e}")
 
 
+# --- LLM Response Cache ---
+@st.cache_resource
+def setup_llm_cache():
+    """
+    Installs a process-wide SQLite cache for LLM responses, so repeated prompts
+    are answered locally. Safe because the model runs with temperature=0.0.
+    """
+    logger.info("Setting up LLM cache at %s...", LLM_CACHE_PATH)
+    set_llm_cache(SQLiteCache(database_path=LLM_CACHE_PATH))
+    return True
+
 # --- Cache only the Model ---
+# Kept on st.cache_resource rather than a module-level global: Streamlit re-executes
+# this script on every rerun, which would reset a global and rebuild the client
+# (and its HTTP connection pool) each time. The cached instance is already shared
+# by all sessions for the lifetime of the process, and creation is locked by Streamlit.
 @st.cache_resource
-def get_model():
+def get_model() -> ChatOpenAI:
     """Loads and caches the ChatOpenAI model."""
-    print("Loading ChatOpenAI model...")
+    logger.info("Loading ChatOpenAI model...")
     # Bind the stop sequence appropriate for function calling if needed (depends on model)
     # model = ChatOpenAI(model=MODEL_NAME, temperature=0.0).bind_tools(tools) # Bind tools later
-    model = ChatOpenAI(model=MODEL_NAME, temperature=0.0)
-    print("Model loaded.")
+    if LOCAL_LLM_BASE_URL:
+        logger.info("Using self-hosted model %s at %s", MODEL_NAME, LOCAL_LLM_BASE_URL)
+        model = ChatOpenAI(
+            model=MODEL_NAME,
+            base_url=LOCAL_LLM_BASE_URL,
+            api_key=os.environ.get("LOCAL_LLM_API_KEY", "EMPTY"), # vLLM ignores it unless started with --api-key
+            temperature=0.0,
+        )
+    else:
+        model = ChatOpenAI(model=MODEL_NAME, temperature=0.0)
+    logger.info("Model loaded.")
     return model
 
+# --- Tool Result Cache ---
+class LRUCache(OrderedDict):
+    """Small in-process LRU mapping; used in front of (or instead of) the disk cache."""
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+@st.cache_resource
+def get_tool_cache():
+    """
+    Returns (memory_cache, disk_cache) for auxiliary-table tool results.
+    disk_cache is a diskcache.Cache that survives restarts, or None if diskcache isn't installed.
+    """
+    disk_cache = None
+    try:
+        import diskcache
+
+        disk_cache = diskcache.Cache(TOOL_CACHE_DIR)
+        logger.info("Tool result cache persisted at %s", TOOL_CACHE_DIR)
+    except ImportError:
+        logger.warning("diskcache not installed; tool results are cached in memory only.")
+    return LRUCache(TOOL_CACHE_MAXSIZE), disk_cache
+
+
+def with_tool_cache(tool, tool_cache):
+    """
+    Returns a copy of an MCP tool whose results are looked up in / stored to the
+    tool cache, keyed by (tool name, JSON of the arguments). Entries expire after
+    TOOL_CACHE_TTL_LONG, or TOOL_CACHE_TTL_SHORT for search/page lookups, which are
+    not persisted to disk. Tools not listed in CACHEABLE_TOOLS are returned unchanged.
+    """
+    if tool.name not in CACHEABLE_TOOLS or tool.coroutine is None:
+        return tool
+    memory_cache, disk_cache = tool_cache
+    call_tool = tool.coroutine
+
+    async def cached_call_tool(**arguments):
+        key = (tool.name, json.dumps(arguments, sort_keys=True, ensure_ascii=False, default=str))
+        now = time.time() # Wall clock, so expiry times are comparable with the disk cache's
+        result = None
+        entry = memory_cache.get(key) # (expires_at, result)
+        if entry is not None and entry[0] > now:
+            result = entry[1]
+        elif disk_cache is not None:
+            result, expires_at = disk_cache.get(key, expire_time=True)
+            if result is not None and expires_at is None:
+                # Stored without an expiry (older versions of this cache): treat as stale
+                disk_cache.delete(key)
+                result = None
+            elif result is not None:
+                memory_cache[key] = (expires_at, result)
+        if result is not None:
+            logger.debug("Tool cache hit for %s", key)
+            return result
+
+        result = await call_tool(**arguments)
+        # Results are (content, artifact) for MCP tools; don't cache empty/failed lookups
+        content = result[0] if isinstance(result, tuple) else result
+        if content:
+            # Same short/long policy as the server, so its own TTLs and stale fallback stay in charge
+            is_search = arguments.get("search") is not None or arguments.get("page") is not None
+            ttl = TOOL_CACHE_TTL_SHORT if is_search else TOOL_CACHE_TTL_LONG
+            memory_cache[key] = (now + ttl, result)
+            if disk_cache is not None and not is_search:
+                disk_cache.set(key, result, expire=ttl)
+        return result
+
+    return tool.model_copy(update={"coroutine": cached_call_tool})
+
+
 # --- Agent State Definition ---
-class AgentState(dict):
-    messages: Annotated[Sequence[BaseMessage], operator.add]
+class AgentState(TypedDict):
+    # add_messages appends (or updates by message id) instead of copying the whole list
+    messages: Annotated[list[BaseMessage], add_messages]
 
 # --- Graph Node Functions ---
 
 # Node to decide whether to call tools or end
 def should_continue(state: AgentState) -> str:
     """Checks the latest AI message for tool calls."""
+    messages = state["messages"]
     # Ensure messages exist before accessing the last one
-    if not state or not state.get('messages'):
+    if not messages:
          # This case should ideally not happen in a normal flow after the first message
-         print("[WARN] should_continue called with empty state or no messages.")
+         logger.warning("should_continue called with no messages.")
          return "end"
-    last_message = state['messages'][-1]
+    last_message = messages[-1]
     # If there are no tool calls, finish
     if not isinstance(last_message, AIMessage) or not last_message.tool_calls:
         return "end"
     # Otherwise call tools
     return "continue"
 
+def trim_history(messages: list[BaseMessage]) -> list[BaseMessage]:
+    """
+    Keeps the most recent messages within MAX_HISTORY_TOKENS so the prompt sent on
+    each agent step stays bounded. The trimmed list never starts on a ToolMessage
+    (which would orphan it from its tool call), and the user's question is always kept.
+    """
+    trimmed = trim_messages(
+        messages,
+        max_tokens=MAX_HISTORY_TOKENS,
+        strategy="last",
+        token_counter=count_tokens_approximately,
+        start_on=("human", "ai"),
+        include_system=True,
+    )
+    if not trimmed:
+        # The latest exchange alone exceeds the budget; sending it untrimmed beats sending nothing
+        return messages
+    if len(trimmed) < len(messages):
+        logger.debug("Trimmed history from %d to %d messages", len(messages), len(trimmed))
+        question = next((message for message in messages if isinstance(message, HumanMessage)), None)
+        if question is not None and question not in trimmed:
+            trimmed = [question] + trimmed
+    return trimmed
+
 # Node that calls the LLM
 def call_model(state: AgentState, model_with_tools, agent_prompt):
-    """Invokes the LLM with the current state and prompt."""
-    print(">>> Calling Model Node")
+    """Invokes the LLM with the current state (trimmed to the token budget) and prompt."""
+    logger.debug(">>> Calling Model Node")
     # Create the prompt with current messages
-    prompt_value = agent_prompt.invoke(state)
+    prompt_value = agent_prompt.invoke({"messages": trim_history(state["messages"])})
     # Call the model
     response = model_with_tools.invoke(prompt_value)
-    print(f"<<< Model Response: {response}")
+    logger.debug("<<< Model Response: %r", response)
     # Return *only the new message* to be added to the state by the graph
     return {"messages": [response]} # MODIFIED LINE
 
 
-# --- Heavily Modified run_agent_async ---
-async def run_agent_async(model, user_query: str) -> str:
+# Raised by MCP tool calls once the session's streams are closed (e.g. the server process died)
+# or when the server stops answering; the connection has to be replaced.
+MCP_SESSION_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream, McpError)
+
+# Node that runs the tools requested by the LLM
+def make_tool_node(tools, on_session_lost=None):
+    """
+    Returns an async node that runs every tool call of the last AIMessage
+    concurrently (asyncio.gather), with at most TOOL_CONCURRENCY calls in flight
+    on the MCP server at a time. Tool failures become ToolMessages with
+    status="error" instead of aborting the run, as with the prebuilt ToolNode.
+    Errors meaning the MCP session itself is gone (MCP_SESSION_ERRORS) are reported
+    to on_session_lost and re-raised instead: retrying the tool could not succeed.
+    """
+    tools_by_name = {tool.name: tool for tool in tools}
+    # Shared by every run of the graph, i.e. by every caller of this MCP connection
+    semaphore = asyncio.Semaphore(TOOL_CONCURRENCY)
+
+    async def run_tool_call(tool_call) -> ToolMessage:
+        tool = tools_by_name.get(tool_call["name"])
+        if tool is None:
+            return ToolMessage(
+                content=f"Error: {tool_call['name']} is not a valid tool, try one of [{', '.join(tools_by_name)}].",
+                name=tool_call["name"],
+                tool_call_id=tool_call["id"],
+                status="error",
+            )
+        async with semaphore:
+            try:
+                # Invoking with the full tool call makes the tool return a ToolMessage
+                return await tool.ainvoke({**tool_call, "type": "tool_call"})
+            except MCP_SESSION_ERRORS as session_e:
+                if on_session_lost:
+                    on_session_lost(session_e)
+                raise
+            except Exception as tool_e:
+                logger.warning("Tool '%s' failed: %s", tool.name, tool_e)
+                return ToolMessage(
+                    content=f"Error: {tool_e!r}\n Please fix your mistakes.",
+                    name=tool.name,
+                    tool_call_id=tool_call["id"],
+                    status="error",
+                )
+
+    async def call_tools(state: AgentState):
+        tool_calls = state["messages"][-1].tool_calls
+        logger.debug(">>> Calling %d tool(s)", len(tool_calls))
+        tool_messages = await asyncio.gather(*(run_tool_call(tool_call) for tool_call in tool_calls))
+        return {"messages": list(tool_messages)}
+
+    return call_tools
+
+
+# --- Cache the tool-bound model ---
+@st.cache_resource(max_entries=8)
+def bind_model_tools(_model, _tools, tools_key):
+    """
+    Binds the tool schemas to the model. Unlike the tools themselves, the
+    binding holds no reference to the MCP session, so it is keyed only by
+    tools_key (model name, sorted tool names) and shared across connections.
+    """
+    logger.info("Binding tools to model for %s...", tools_key)
+    return _model.bind_tools(_tools)
+
+
+# --- Build the compiled agent graph ---
+def build_agent_app(model_with_tools, tools, on_session_lost=None):
+    """
+    Builds and compiles the agent graph. Not cached with st.cache_resource: the
+    graph's tools are bound to one MCP session, so the graph is built once per
+    connection and kept on MCPConnection.app for as long as the connection lives.
+    """
+    # --- Define Graph Nodes ---
+    # The prompt is looked up per call, so a long-lived cached graph picks up date changes
+    bound_call_model = lambda state: call_model(state, model_with_tools, get_agent_prompt())
+    tool_node = make_tool_node(tools, on_session_lost)
+
+    # --- Build Graph ---
+    logger.info("Building agent graph...")
+    graph = StateGraph(AgentState)
+    graph.add_node("agent", bound_call_model)
+    graph.add_node("action", tool_node)
+    graph.set_entry_point("agent")
+    graph.add_conditional_edges(
+        "agent", should_continue, {"continue": "action", "end": END}
+    )
+    graph.add_edge("action", "agent")
+    app = graph.compile()
+    logger.info("Agent graph compiled.")
+    return app
+
+
+# --- Persistent MCP Connection ---
+@dataclass
+class MCPConnection:
+    """An open MCP stdio session plus the tools and agent graph built on top of it."""
+    read: Any
+    write: Any
+    session: ClientSession
+    tools: list
+    model_with_tools: Any
+    app: Any
+    loop: asyncio.AbstractEventLoop
+    # The stdio_client / ClientSession contexts are entered by this task (via an
+    # AsyncExitStack) and must be exited by it too, so closing is signalled through an event.
+    _owner: asyncio.Task = field(repr=False)
+    _closing: asyncio.Event = field(repr=False)
+
+    def is_alive(self) -> bool:
+        """True while the session can still be used from the current event loop."""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        return not self._owner.done() and not self._closing.is_set() and self.loop is running_loop
+
+    async def ping(self) -> bool:
+        """
+        Round-trips a ping to the server. stdio_client doesn't end the session when the
+        server process dies, so this is how a dead pooled connection is noticed.
+        """
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=MCP_PING_TIMEOUT)
+            return True
+        except Exception as ping_e:
+            self.mark_lost(ping_e)
+            return False
+
+    def mark_lost(self, reason: BaseException):
+        """Takes the connection out of service; its owner task then closes the session."""
+        if not self._closing.is_set():
+            logger.warning("MCP session lost (%r), it will be replaced on the next query.", reason)
+        self._closing.set()
+
+    async def aclose(self):
+        """Closes the MCP session and shuts down the server subprocess."""
+        self._closing.set()
+        try:
+            await self._owner
+        except Exception as close_e:
+            logger.warning("Error while closing MCP session: %s", close_e)
+
+
+@dataclass
+class MCPRegistry:
+    """
+    Pool of open MCP connections keyed by server parameters hash, shared by all
+    Streamlit sessions. Tracks which sessions use each connection; one connect lock per key.
+    """
+    connections: dict = field(default_factory=dict)
+    sessions: dict = field(default_factory=dict)
+    locks: dict = field(default_factory=dict)
+
+
+@st.cache_resource
+def get_mcp_registry() -> MCPRegistry:
+    """Returns the process-wide MCP registry (cached, so it survives script reruns)."""
+    return MCPRegistry()
+
+
+async def _open_mcp_session(server_params: StdioServerParameters):
     """
-    Establishes MCP connection, loads tools, creates a custom agent graph,
-    runs invocation asynchronously using ainvoke, extracts the final response,
-    and appends tool usage information.
+    Starts a task that enters stdio_client + ClientSession and keeps them open
+    until its closing event is set. Returns (read, write, session, owner_task, closing_event).
     """
-    print(f"\nInvoking agent with query: '{user_query}'")
+    ready = asyncio.get_running_loop().create_future()
+    closing = asyncio.Event()
+
+    async def hold_session():
+        try:
+            async with AsyncExitStack() as stack:
+                read, write = await stack.enter_async_context(stdio_client(server_params))
+                session = await stack.enter_async_context(
+                    ClientSession(read, write, read_timeout_seconds=datetime.timedelta(seconds=MCP_READ_TIMEOUT))
+                )
+                ready.set_result((read, write, session))
+                await closing.wait()
+            logger.info("MCP Session closed.")
+        except Exception as session_e:
+            if not ready.done():
+                ready.set_exception(session_e)
+            else:
+                logger.warning("MCP session ended with an error: %s", session_e)
+        finally:
+            if not ready.done():
+                ready.cancel()
+
+    owner = asyncio.create_task(hold_session())
+    read, write, session = await ready
+    return read, write, session, owner, closing
 
-    server_params = StdioServerParameters(
+
+def get_server_params() -> StdioServerParameters:
+    """Parameters for spawning the ComexStat MCP server subprocess."""
+    return StdioServerParameters(
         command=sys.executable,
         args=[SERVER_SCRIPT_PATH],
         # --- ADD environment variable ---
         env={"PYTHONUTF8": "1", **os.environ}, # Force UTF-8 for the subprocess
     )
-    agent_result = "Error: Agent execution did not complete as expected."
-    # TOOL_LOAD_TIMEOUT = 45.0 # REMOVE from here
+
+
+def mcp_pool_key(server_params: StdioServerParameters) -> str:
+    """Hashes (command, args, env) so sessions spawning the same server share one connection."""
+    key = f"{server_params.command}|{server_params.args}|{sorted((server_params.env or {}).items())}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+async def _connect_mcp(model, server_params: StdioServerParameters) -> MCPConnection:
+    """
+    Spawns the MCP server, initializes the session, loads tools and compiles
+    the agent graph. Raises TimeoutError, ValueError or RuntimeError on setup failures.
+    """
+    logger.info("Establishing persistent MCP connection...")
+    read, write, session, owner, closing = await _open_mcp_session(server_params)
+    logger.info("MCP Session active.")
 
     try:
-        # ... (MCP connection, session, tool loading, graph building remain the same) ...
-        print("Establishing MCP connection for agent run...")
-        async with stdio_client(server_params) as (read, write):
-            async with ClientSession(read, write) as session:
-                print("MCP Session active.")
-
-                # --- Load Tools and Build Graph within the active session ---
-                app = None # Compiled graph
-                try:
-                    # ... (Initialization, Tool Loading, Model Binding, Prompt, Graph Building - all remain the same) ...
-                    # --- Initialize session ---
-                    try:
-                        print("Initializing MCP session...")
-                        # Now uses the module-level constant
-                        await asyncio.wait_for(session.initialize(), timeout=TOOL_LOAD_TIMEOUT)
-                        print("MCP session initialized.")
-                    except asyncio.TimeoutError:
-                         # Now uses the module-level constant
-                         raise TimeoutError(f"Timeout ({TOOL_LOAD_TIMEOUT}s) occurred during MCP session initialization.")
-                    except Exception as init_e:
-                         raise RuntimeError(f"Error during MCP session initialization: {init_e}")
-
-                    # --- Load tools ---
-                    print("Loading tools using active session...")
-                    try:
-                        loaded_tools = await asyncio.wait_for(
-                            load_mcp_tools(session),
-                            # Now uses the module-level constant
-                            timeout=TOOL_LOAD_TIMEOUT
-                        )
-                        if not loaded_tools:
-                            raise ValueError("No tools loaded from the MCP server.")
-                        tools = loaded_tools
-                        print(f"Tools loaded successfully: {[tool.name for tool in tools]}")
-                    except asyncio.TimeoutError:
-                         # Now uses the module-level constant
-                         raise TimeoutError(f"Timeout ({TOOL_LOAD_TIMEOUT}s) occurred during tool loading.")
-                    except Exception as load_e:
-                         raise RuntimeError(f"Error during tool loading: {load_e}")
-
-                    # --- Bind tools to model ---
-                    model_with_tools = model.bind_tools(tools)
-
-                    # --- Define Prompt ---
-                    agent_prompt = ChatPromptTemplate.from_messages(
-                        [
-                            SystemMessage(content=CUSTOM_SYSTEM_PROMPT),
-                            MessagesPlaceholder(variable_name="messages"),
-                        ]
-                    )
-
-                    # --- Define Graph Nodes ---
-                    bound_call_model = lambda state: call_model(state, model_with_tools, agent_prompt)
-                    tool_node = ToolNode(tools)
-
-                    # --- Build Graph ---
-                    print("Building agent graph...")
-                    graph = StateGraph(AgentState)
-                    graph.add_node("agent", bound_call_model)
-                    graph.add_node("action", tool_node)
-                    graph.set_entry_point("agent")
-                    graph.add_conditional_edges(
-                        "agent", should_continue, {"continue": "action", "end": END}
-                    )
-                    graph.add_edge("action", "agent")
-                    app = graph.compile()
-                    print("Agent graph compiled.")
-
-                except (TimeoutError, ValueError, RuntimeError) as setup_e:
-                    error_message = f"Error during setup: {setup_e}"
-                    print(error_message)
-                    traceback.print_exc()
-                    return error_message
-                except Exception as setup_e:
-                    error_message = f"Unexpected error during setup: {setup_e}"
-                    print(error_message)
-                    traceback.print_exc()
-                    return error_message
-
-
-                # --- Run the agent graph using ainvoke ---
-                if app:
-                    agent_input = {"messages": [HumanMessage(content=user_query)]}
-                    final_state = None
-
-                    try:
-                        print("Starting agent graph execution (using ainvoke)...")
-                        final_state = await app.ainvoke(agent_input)
-                        print("Agent execution finished.")
-                        print(f"[DEBUG] Value of final_state after ainvoke: Type={type(final_state)}, Value={final_state}")
-
-                        # --- Extract result AND tool calls from the FINAL state ---
-                        final_content = None
-                        tool_calls_info = [] # List to store formatted tool calls
-
-                        if final_state and isinstance(final_state, dict) and "messages" in final_state:
-                            messages = final_state["messages"]
-
-                            # --- Extract Tool Calls from History ---
-                            for message in messages:
-                                if isinstance(message, AIMessage) and message.tool_calls:
-                                    for tool_call in message.tool_calls:
-                                        tool_name = tool_call.get("name")
-                                        tool_args = tool_call.get("args")
-                                        # Format the tool call info
-                                        tool_calls_info.append(f"* **Tool:** `{tool_name}`\n* **Arguments:** `{tool_args}`")
-
-                            # --- Extract Final Content ---
-                            if messages and isinstance(messages[-1], AIMessage):
-                                last_ai_message = messages[-1]
-                                if not last_ai_message.tool_calls and hasattr(last_ai_message, 'content'):
-                                    content = str(last_ai_message.content or "").strip()
-                                    if content:
-                                        print(f"[DEBUG] Extracted final content from last AIMessage: '{content[:100]}...'")
-                                        final_content = content # Store final content separately
-                                    else:
-                                        print("[WARN] Final AIMessage has no content.")
-                                        agent_result = "Agent finished, but the final message was empty."
-                                elif last_ai_message.tool_calls:
-                                     print("[WARN] Agent finished on an AIMessage with tool calls.")
-                                     agent_result = "Agent finished unexpectedly while planning to use tools."
-                                else:
-                                     print("[WARN] Final AIMessage has no tool calls but no content attribute?")
-                                     agent_result = "Agent finished, but couldn't extract content from the final message."
-                            elif messages and isinstance(messages[-1], ToolMessage):
-                                 last_tool_msg = messages[-1]
-                                 if getattr(last_tool_msg, 'status', None) == 'error':
-                                      tool_error_content = f"Tool '{last_tool_msg.name}' failed: {last_tool_msg.content}"
-                                      print(f"[ERROR] {tool_error_content}")
-                                      agent_result = f"An error occurred during tool execution: {tool_error_content}"
-                                 else:
-                                      print("[WARN] Agent finished after a successful tool execution without a final AI response.")
-                                      agent_result = f"Agent finished after using tool '{last_tool_msg.name}', but didn't provide a final summary."
-                            else:
-                                print("[WARN] Final state has no messages or last message is not AI/Tool.")
-                                agent_result = "Agent finished, but the final state is unexpected."
+        # --- Initialize session ---
+        try:
+            logger.info("Initializing MCP session...")
+            await asyncio.wait_for(session.initialize(), timeout=MCP_INIT_TIMEOUT)
+            logger.info("MCP session initialized.")
+        except asyncio.TimeoutError:
+             raise TimeoutError(f"Timeout ({MCP_INIT_TIMEOUT}s) occurred during MCP session initialization.")
+        except Exception as init_e:
+             raise RuntimeError(f"Error during MCP session initialization: {init_e}")
+
+        # --- Load tools ---
+        logger.info("Loading tools using active session...")
+        try:
+            loaded_tools = await asyncio.wait_for(
+                load_mcp_tools(session),
+                timeout=MCP_LOAD_TIMEOUT
+            )
+            if not loaded_tools:
+                raise ValueError("No tools loaded from the MCP server.")
+            tool_cache = get_tool_cache()
+            tools = [with_tool_cache(tool, tool_cache) for tool in loaded_tools]
+            logger.info("Tools loaded successfully: %s", [tool.name for tool in tools])
+        except asyncio.TimeoutError:
+             raise TimeoutError(f"Timeout ({MCP_LOAD_TIMEOUT}s) occurred during tool loading.")
+        except ValueError:
+             raise
+        except Exception as load_e:
+             raise RuntimeError(f"Error during tool loading: {load_e}")
+
+        # --- Bind tools to model (reused across reconnects) ---
+        tool_names = tuple(sorted(tool.name for tool in tools))
+        model_with_tools = bind_model_tools(model, tools, (MODEL_NAME, tool_names))
+
+        # --- Compile the agent graph (bound to this session's tools) ---
+        app = build_agent_app(model_with_tools, tools, on_session_lost=lambda e: closing.set())
+    except BaseException:
+        # Don't leave a half-initialized server subprocess running
+        closing.set()
+        await owner
+        raise
+
+    conn = MCPConnection(
+        read=read,
+        write=write,
+        session=session,
+        tools=tools,
+        model_with_tools=model_with_tools,
+        app=app,
+        loop=asyncio.get_running_loop(),
+        _owner=owner,
+        _closing=closing,
+    )
+    return conn
 
-                            # --- Combine final content and tool calls ---
-                            if final_content:
-                                agent_result = final_content # Start with the main answer
-                                if tool_calls_info:
-                                    # Append tool call info if any were found
-                                    agent_result += "\n\n---\n**Tools Used:**\n" + "\n\n".join(tool_calls_info)
-                            # If final_content is None, agent_result might already be set to an error/warning message
 
-                        else:
-                            print("[WARN] final_state after ainvoke is not a valid dict with 'messages'.")
-                            agent_result = "Agent execution did not produce the expected final state structure."
+async def get_or_create_mcp(model, session_id: str) -> MCPConnection:
+    """
+    Returns the pooled MCP connection for the ComexStat server and registers
+    session_id as one of its users. Connects (spawning the server, initializing,
+    loading tools, compiling the graph) only if no live connection exists for the
+    pool key. Must run on the agent event loop.
+    """
+    server_params = get_server_params()
+    key = mcp_pool_key(server_params)
+    registry = get_mcp_registry()
+    lock = registry.locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        session_ids = registry.sessions.setdefault(key, set())
+        if session_id != WARMUP_SESSION_ID:
+            # A real session holds the connection now; the warm-up only bridges until the first one,
+            # so the connection closes once the last real session leaves (see release_mcp)
+            session_ids.discard(WARMUP_SESSION_ID)
+            session_ids.add(session_id)
+        elif not session_ids:
+            session_ids.add(session_id)
+        conn = registry.connections.get(key)
+        if conn is not None and conn.is_alive() and await conn.ping():
+            return conn
+        if conn is not None:
+            logger.warning("Previous MCP connection is no longer usable, reconnecting...")
+            del registry.connections[key]
+            try:
+                await asyncio.wait_for(conn.aclose(), timeout=MCP_INIT_TIMEOUT) # Reap the old subprocess
+            except asyncio.TimeoutError:
+                logger.warning("Timed out closing the previous MCP connection.")
+        logger.info("No pooled MCP connection for key %s, connecting...", key[:12])
+        conn = await _connect_mcp(model, server_params)
+        registry.connections[key] = conn
+        return conn
+
+
+async def release_mcp(session_id: str):
+    """Unregisters a session from the pool, closing connections no other session uses."""
+    registry = get_mcp_registry()
+    for key, session_ids in list(registry.sessions.items()):
+        if session_id not in session_ids:
+            continue
+        async with registry.locks.setdefault(key, asyncio.Lock()):
+            session_ids.discard(session_id)
+            if session_ids:
+                continue
+            del registry.sessions[key]
+            conn = registry.connections.pop(key, None)
+            if conn is not None:
+                logger.info("Last session left MCP connection %s, closing it...", key[:12])
+                await conn.aclose()
+
+
+class MCPLease:
+    """
+    Kept in st.session_state. Streamlit drops the session state when a browser
+    session ends, and the lease's finalizer then releases the session's pool entry.
+    """
+    def __init__(self, session_id: str, loop: asyncio.AbstractEventLoop):
+        self.session_id = session_id
+        weakref.finalize(self, MCPLease._release, session_id, loop)
+
+    @staticmethod
+    def _release(session_id: str, loop: asyncio.AbstractEventLoop):
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(release_mcp(session_id), loop)
+
+
+def _close_mcp_connections(loop: asyncio.AbstractEventLoop, registry: MCPRegistry):
+    """atexit hook: closes every open MCP session on the agent event loop."""
+    if not loop.is_running():
+        return
+    for conn in list(registry.connections.values()):
+        try:
+            asyncio.run_coroutine_threadsafe(conn.aclose(), loop).result(timeout=10)
+        except Exception as close_e:
+            logger.warning("Failed to close MCP connection on exit: %s", close_e)
+    registry.connections.clear()
+    registry.sessions.clear()
+
+
+# --- Background Event Loop ---
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Starts (once per process) a daemon thread running an event loop forever.
+    All agent runs are submitted to it, so MCP sessions stay open and keep
+    being serviced between queries.
+    """
+    logger.info("Starting background event loop thread...")
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="agent-event-loop", daemon=True).start()
+    atexit.register(_close_mcp_connections, loop, get_mcp_registry())
+    return loop
+
+
+# Pool user that keeps the warmed-up MCP connection open until the first real session joins
+WARMUP_SESSION_ID = "__warmup__"
+
 
-                    except Exception as agent_run_e:
-                        error_message = f"An error occurred during agent execution (ainvoke): {agent_run_e}"
-                        print(error_message)
-                        traceback.print_exc()
-                        agent_result = error_message
+@st.cache_resource
+def start_mcp_warmup(_model) -> concurrent.futures.Future:
+    """
+    Schedules (once per process) the MCP connection setup on the background loop
+    without waiting for it, so the server is spawned and tools are loaded while
+    the user is still typing the first question.
+    """
+    logger.info("Warming up MCP connection in the background...")
+    future = asyncio.run_coroutine_threadsafe(get_or_create_mcp(_model, WARMUP_SESSION_ID), get_event_loop())
+
+    def report(done_future):
+        if done_future.exception() is not None:
+            logger.warning("MCP warm-up failed, will retry on first query: %s", done_future.exception())
+        else:
+            logger.info("MCP warm-up finished.")
+
+    future.add_done_callback(report)
+    return future
+
+
+def run_agent_in_background(model, user_query: str, session_id: str, on_token=None):
+    """
+    Runs run_agent_async on the background loop and blocks until it finishes.
+    Streamed text is handed over through a queue so on_token (which touches
+    Streamlit elements) is always called from the script thread.
+    """
+    token_queue = queue.SimpleQueue()
+    future = asyncio.run_coroutine_threadsafe(
+        run_agent_async(model, user_query, session_id, on_token=token_queue.put),
+        get_event_loop(),
+    )
+    while True:
+        try:
+            result = future.result(timeout=0.05)
+            break
+        except concurrent.futures.TimeoutError:
+            pass
+        finally:
+            # Only the most recent text matters; skip intermediate updates
+            latest_text = None
+            while not token_queue.empty():
+                latest_text = token_queue.get_nowait()
+            if latest_text is not None and on_token:
+                on_token(latest_text)
+    return result
+
+
+# --- Agent Result ---
+@dataclass
+class AgentResult:
+    """Outcome of one agent run: ok is False when content is an error message."""
+    ok: bool
+    content: str
+    tool_calls: list[dict] = field(default_factory=list) # [{"name": ..., "args": ...}] in call order
+
+
+def render_tool_calls(tool_calls: list[dict]):
+    """Shows the tools used for an answer in a collapsed expander."""
+    if not tool_calls:
+        return
+    with st.expander("Tools Used"):
+        for tool_call in tool_calls:
+            st.markdown(f"* **Tool:** `{tool_call['name']}`")
+            st.json(tool_call["args"], expanded=False)
+
+
+# --- Heavily Modified run_agent_async ---
+async def run_agent_async(model, user_query: str, session_id: str, on_token=None) -> AgentResult:
+    """
+    Reuses (or establishes) the session's persistent MCP connection and agent graph,
+    runs the graph with astream_events and returns the final response together
+    with the tool calls made, as an AgentResult.
+
+    If on_token is given, it is called with the text generated so far by the
+    current model call every time a new token is streamed.
+    """
+    logger.info("Invoking agent with query: %r", user_query)
 
-        print("MCP Session closed.")
+    agent_result = AgentResult(ok=False, content="Error: Agent execution did not complete as expected.")
+
+    try:
+        # --- Get the persistent connection (tools and graph are built once) ---
+        try:
+            conn = await get_or_create_mcp(model, session_id)
+        except (TimeoutError, ValueError, RuntimeError) as setup_e:
+            error_message = f"Error during setup: {setup_e}"
+            logger.exception(error_message)
+            return AgentResult(ok=False, content=error_message)
+        app = conn.app
+
+        # --- Run the agent graph, streaming tokens as they arrive ---
+        if app:
+            agent_input = {"messages": [HumanMessage(content=user_query)]}
+            final_state = None
+
+            try:
+                logger.info("Starting agent graph execution (using astream_events)...")
+                streamed_text = ""
+                tool_calls = [] # Tool calls made during this run, collected as the agent emits them
+                async for event in app.astream_events(agent_input, version="v2"):
+                    kind = event["event"]
+                    if kind == "on_chat_model_start":
+                        # Each agent step is a new model call; only stream the current one
+                        streamed_text = ""
+                    elif kind == "on_chat_model_stream":
+                        token = event["data"]["chunk"].content
+                        if token and isinstance(token, str):
+                            streamed_text += token
+                            if on_token:
+                                on_token(streamed_text)
+                    elif kind == "on_chain_end" and event["name"] == "agent":
+                        # Output of the agent node: {"messages": [AIMessage]} for this step only
+                        for message in (event["data"].get("output") or {}).get("messages", []):
+                            if isinstance(message, AIMessage) and message.tool_calls:
+                                for tool_call in message.tool_calls:
+                                    tool_calls.append({"name": tool_call.get("name"), "args": tool_call.get("args")})
+                    elif kind == "on_chain_end" and not event.get("parent_ids"):
+                        # The root graph run ends last and carries the final state
+                        final_state = event["data"].get("output")
+                logger.info("Agent execution finished.")
+                logger.debug("Value of final_state after astream_events: Type=%s, Value=%r", type(final_state), final_state)
+
+                # --- Extract result from the FINAL state (tool calls were collected while streaming) ---
+                if final_state and isinstance(final_state, dict) and "messages" in final_state:
+                    messages = final_state["messages"]
+                    error_message = None
+
+                    # --- Extract Final Content ---
+                    if messages and isinstance(messages[-1], AIMessage):
+                        last_ai_message = messages[-1]
+                        if not last_ai_message.tool_calls and hasattr(last_ai_message, 'content'):
+                            content = str(last_ai_message.content or "").strip()
+                            if content:
+                                logger.debug("Extracted final content from last AIMessage: %r...", content[:100])
+                                agent_result = AgentResult(ok=True, content=content, tool_calls=tool_calls)
+                            else:
+                                logger.warning("Final AIMessage has no content.")
+                                error_message = "Agent finished, but the final message was empty."
+                        elif last_ai_message.tool_calls:
+                             logger.warning("Agent finished on an AIMessage with tool calls.")
+                             error_message = "Agent finished unexpectedly while planning to use tools."
+                        else:
+                             logger.warning("Final AIMessage has no tool calls but no content attribute?")
+                             error_message = "Agent finished, but couldn't extract content from the final message."
+                    elif messages and isinstance(messages[-1], ToolMessage):
+                         last_tool_msg = messages[-1]
+                         if getattr(last_tool_msg, 'status', None) == 'error':
+                              tool_error_content = f"Tool '{last_tool_msg.name}' failed: {last_tool_msg.content}"
+                              logger.error(tool_error_content)
+                              error_message = f"An error occurred during tool execution: {tool_error_content}"
+                         else:
+                              logger.warning("Agent finished after a successful tool execution without a final AI response.")
+                              error_message = f"Agent finished after using tool '{last_tool_msg.name}', but didn't provide a final summary."
+                    else:
+                        logger.warning("Final state has no messages or last message is not AI/Tool.")
+                        error_message = "Agent finished, but the final state is unexpected."
+
+                    if error_message:
+                        agent_result = AgentResult(ok=False, content=error_message, tool_calls=tool_calls)
+
+                else:
+                    logger.warning("final_state after astream_events is not a valid dict with 'messages'.")
+                    agent_result = AgentResult(ok=False, content="Agent execution did not produce the expected final state structure.")
+
+            except MCP_SESSION_ERRORS as session_e:
+                conn.mark_lost(session_e) # The next query reconnects instead of reusing a dead session
+                error_message = f"The connection to the ComexStat server was lost ({session_e!r}). Please ask again."
+                logger.exception(error_message)
+                agent_result = AgentResult(ok=False, content=error_message)
+            except Exception as agent_run_e:
+                error_message = f"An error occurred during agent execution (astream_events): {agent_run_e}"
+                logger.exception(error_message)
+                agent_result = AgentResult(ok=False, content=error_message)
 
     # ... (Outer exception handling remains the same) ...
     except ConnectionRefusedError:
         error_message = f"Error: Connection refused. Is the MCP server ({SERVER_SCRIPT_PATH}) running or startable?"
-        print(error_message)
-        agent_result = error_message
+        logger.error(error_message)
+        agent_result = AgentResult(ok=False, content=error_message)
     except asyncio.TimeoutError:
          error_message = "Error: Timeout occurred during MCP connection/setup."
-         print(error_message)
-         agent_result = error_message
+         logger.error(error_message)
+         agent_result = AgentResult(ok=False, content=error_message)
     except Exception as conn_e:
         error_message = f"An unexpected error occurred during MCP connection/setup phase: {conn_e}"
-        print(error_message)
-        traceback.print_exc()
-        agent_result = error_message
+        logger.exception(error_message)
+        agent_result = AgentResult(ok=False, content=error_message)
 
     return agent_result
 
@@ -340,6 +915,11 @@ async def run_agent_async(model, user_query: str) -> str:
 st.title("🚢 Bem-vinda(o) ao ComexChat!")
 st.caption("💬 Consultas interativas às estatísticas brasileiras de comércio exterior")
 
+# Identifies this browser session in the MCP connection pool; the lease releases it when the session ends
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+    st.session_state.mcp_lease = MCPLease(st.session_state.session_id, get_event_loop())
+
 # Initialize chat history
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -348,13 +928,16 @@ if "messages" not in st.session_state:
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        render_tool_calls(message.get("tool_calls"))
 
 # --- Load Only Model (Cached) ---
-# We load the model once. Agent Executor is created per query.
+# We load the model once. The MCP connection and agent graph are created on the first query and reused.
+setup_llm_cache() # Must be in place before the model is first called
 model = get_model()
 if model is None:
     st.error("Failed to load the language model. The application cannot start.")
     st.stop()
+start_mcp_warmup(model) # Non-blocking; the first query reuses the warmed-up connection
 
 # React to user input
 if prompt := st.chat_input("Faça sua pergunta sobre os dados do ComexStat..."):
@@ -368,85 +951,45 @@ if prompt := st.chat_input("Faça sua pergunta sobre os dados do ComexStat..."):
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
         message_placeholder.markdown("Pesquisando...")
+        # Show the answer as it is generated; replaced by the final response below
+        stream_to_placeholder = lambda text: message_placeholder.markdown(text + "▌")
         response = ""
-        run_successful = False
+        tool_calls = []
         try:
-            print("[Streamlit DEBUG] Calling asyncio.run(run_agent_async)...")
+            logger.debug("[Streamlit] Submitting run_agent_async to the background event loop...")
             # Pass the cached model to the run function
-            returned_value = asyncio.run(run_agent_async(model, prompt)) # Pass model
-            run_successful = True
-
-            # --- Debugging and Response Handling (mostly unchanged) ---
-            print(f"[Streamlit DEBUG] run_agent_async returned: '{returned_value}' (Type: {type(returned_value)})")
-            if returned_value is not None:
-                 response = str(returned_value).strip()
-                 print(f"[Streamlit DEBUG] Response variable after strip: '{response}'")
-                 if not response: # Check if empty after strip
-                      response = "Error: Agent returned an empty response."
-                      print("[Streamlit DEBUG] Response is empty after processing return value.")
+            result = run_agent_in_background(
+                model, prompt, st.session_state.session_id, on_token=stream_to_placeholder
+            ) # Pass model
+            logger.debug("[Streamlit] run_agent_async returned: %r", result)
+
+            response = result.content.strip()
+            tool_calls = result.tool_calls
+            ok = result.ok
+            if not response: # Check if empty after strip
+                 response = "Error: Agent returned an empty response."
+                 ok = False
+                 logger.warning("[Streamlit] Response is empty after processing return value.")
+
+            # Display the response (could be success or error message from run_agent_async)
+            if ok:
+                 message_placeholder.markdown(response) # Display success
             else:
-                 response = "Error: Agent returned None."
-                 print("[Streamlit DEBUG] Agent returned None.")
-
-            # Display the processed response (could be success or error message from run_agent_async)
-            if "error" in response.lower() or "failed" in response.lower():
                  message_placeholder.error(response) # Display errors using st.error
-            else:
-                 message_placeholder.markdown(response) # Display success
+            render_tool_calls(tool_calls)
 
-        except RuntimeError as e:
-             # --- Handle asyncio loop issues with nest_asyncio (Retry logic) ---
-             if "cannot be called from a running event loop" in str(e):
-                 print("[Streamlit DEBUG] Detected running event loop. Applying nest_asyncio.")
-                 try:
-                     import nest_asyncio
-
-                     nest_asyncio.apply()
-                     print("[Streamlit DEBUG] Retrying asyncio.run(run_agent_async) after nest_asyncio...")
-                     returned_value = asyncio.run(run_agent_async(model, prompt)) # Pass model on retry
-                     run_successful = True
-
-                     # --- Debugging and Response Handling (Retry Path) ---
-                     print(f"[Streamlit DEBUG] run_agent_async (retry) returned: '{returned_value}' (Type: {type(returned_value)})")
-                     if returned_value is not None:
-                          response = str(returned_value).strip()
-                          print(f"[Streamlit DEBUG] Response variable after retry strip: '{response}'")
-                          if not response:
-                               response = "Error: Agent returned an empty response on retry."
-                               print("[Streamlit DEBUG] Response is empty after processing retry return value.")
-                     else:
-                          response = "Error: Agent returned None on retry."
-                          print("[Streamlit DEBUG] Agent returned None on retry.")
-
-                     # Display the processed response (Retry)
-                     if "error" in response.lower() or "failed" in response.lower():
-                          message_placeholder.error(response)
-                     else:
-                          message_placeholder.markdown(response)
-
-                 except ImportError:
-                     response = "Error: nest_asyncio not installed. Cannot run async agent in this Streamlit context."
-                     message_placeholder.error(response)
-                 except Exception as nested_e:
-                     response = f"An error occurred even after applying nest_asyncio: {nested_e}"
-                     message_placeholder.error(response)
-                     traceback.print_exc()
-             else:
-                 response = f"A runtime error occurred: {e}"
-                 message_placeholder.error(response)
-                 traceback.print_exc()
         except Exception as e:
              response = f"An unexpected error occurred: {e}"
              message_placeholder.error(response)
-             traceback.print_exc()
+             logger.exception("[Streamlit] Agent run raised an exception.")
 
-        # Ensure response has a value before adding to history if run wasn't successful
-        # and response wasn't already set by an exception handler
-        if not run_successful and not response:
+        # Ensure response has a value before adding to history
+        # even if it wasn't set by an exception handler
+        if not response:
              response = "An error occurred, and no specific message was captured."
-             print("[Streamlit DEBUG] Setting default error message as response was empty after exception.")
+             logger.warning("[Streamlit] Setting default error message as response was empty after exception.")
 
 
     # Add assistant response to chat history (even if it's an error message)
     # Ensure content is always a string before adding
-    st.session_state.messages.append({"role": "assistant", "content": str(response)})
+    st.session_state.messages.append({"role": "assistant", "content": str(response), "tool_calls": tool_calls})
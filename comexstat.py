@@ -1,54 +1,441 @@
 from typing import Any
+from contextlib import asynccontextmanager
+from types import MappingProxyType
+import anyio
+import asyncio
+import functools
+import logging
+import os
+import ssl
+import sys
+import time
+import certifi
 import httpx
+import ijson
+import orjson
+from tenacity import (
+    before_sleep_log,
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    stop_after_delay,
+    wait_exponential_jitter,
+)
 from mcp.server.fastmcp import FastMCP
-from typing import Any, Dict, List, Optional # Make sure Dict, List, Optional are imported
-
-# Initialize FastMCP server
-mcp = FastMCP("comexstat")
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple # Make sure Dict, List, Optional are imported
 
 
 # Define these constants or import them
 COMEXSTAT_API_BASE = "https://api-comexstat.mdic.gov.br"  # Replace with the actual base URL
 USER_AGENT = "MCP/1.0 (your-email@example.com)" # Replace with a descriptive User-Agent
 
-async def _fetch_comexstat_data(url: str, payload: Dict[str, Any], headers: Dict[str, str]) -> Optional[Dict[str, Any]]:
+# Request invariants, built once at import instead of on every tool call
+_HEADERS = {"User-Agent": USER_AGENT, "Accept": "application/json", "Accept-Encoding": "gzip, br"}
+_JSON_CONTENT_TYPE = {"Content-Type": "application/json"} # Added to requests carrying a body
+_EMPTY = MappingProxyType({}) # Shared read-only fallback for missing response keys
+# Response bodies that are empty results; _iter_rows applies the same rule to streamed bodies.
+# Not b"{}": it has no data.list, so it yields None (the stale-cache fallback, or an error from
+# the data tools) like any other malformed answer.
+_EMPTY_BODIES = frozenset({b"", b"[]"})
+_URL_GENERAL = "/general" # Endpoint paths are relative to COMEXSTAT_API_BASE
+_URL_CITIES = "/cities"
+# Auxiliary tables accepting add/language/search (+ page/perPage for _PARAMS_ALL)
+_PARAMS_ALL = frozenset({"product-categories", "ncm", "hs", "nbm", "classifications"})
+_PARAMS_LIMITED = frozenset({"economic-blocks"})
+# Accepted argument values, checked locally before any HTTP work
+_VALID_TABLES = frozenset({
+    "countries", "uf", "cities", "ways", "urf", "economic-blocks",
+    "product-categories", "ncm", "hs", "nbm", "classifications",
+})
+_VALID_FLOWS = frozenset({"import", "export"})
+# Default query period for dados_gerais / dados_municipio. Read-only so it can never be
+# mutated across calls the way a dict default argument could.
+_DEFAULT_PERIOD = MappingProxyType({"from": "2024-01", "to": "2024-12"})
+
+# Logging goes to stderr: stdout carries the MCP stdio transport, so anything written
+# there would corrupt the protocol stream. The level is read from COMEXSTAT_LOGLEVEL
+# (default WARNING); debug messages are guarded by isEnabledFor so their arguments are
+# not even formatted unless debugging is switched on.
+logger = logging.getLogger("comexstat")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler(sys.stderr)
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.propagate = False
+logger.setLevel(os.environ.get("COMEXSTAT_LOGLEVEL", "WARNING").upper())
+
+# TLS context built once and shared by every pooled connection, so new connections can
+# resume a previous TLS session (session tickets) instead of doing a full handshake.
+# Certificates are verified against certifi's CA bundle (what httpx trusts with verify=True,
+# and available even where the OS has no CA store). COMEXSTAT_CA_BUNDLE adds an extra CA file
+# on top of it (e.g. the ICP-Brasil chain); COMEXSTAT_SSL_VERIFY=0 restores the old unverified mode.
+def _build_ssl_context() -> ssl.SSLContext:
+    ctx = ssl.create_default_context(cafile=certifi.where())
+    extra_ca_bundle = os.environ.get("COMEXSTAT_CA_BUNDLE")
+    if extra_ca_bundle:
+        ctx.load_verify_locations(cafile=extra_ca_bundle)
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    ctx.options &= ~ssl.OP_NO_TICKET  # Keep session tickets enabled for resumption
+    if os.environ.get("COMEXSTAT_SSL_VERIFY", "1").lower() in ("0", "false", "no"):
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+_SSL_CONTEXT = _build_ssl_context()
+
+# Shared HTTP client: keeps connections (and TLS sessions) alive across tool calls
+# instead of opening a new connection per request. Closed by the server lifespan below.
+# HTTP/2 multiplexes concurrent tool calls over one connection, and compressed responses
+# (decoded by httpx; brotli needs the 'brotli' package) cut the size of large JSON results.
+_CLIENT = httpx.AsyncClient(
+    base_url=COMEXSTAT_API_BASE,
+    headers=_HEADERS,
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    timeout=httpx.Timeout(60.0, connect=10.0),
+    verify=_SSL_CONTEXT,
+)
+
+
+@asynccontextmanager
+async def _lifespan(server: FastMCP):
+    """Closes the shared HTTP client when the MCP server shuts down."""
+    try:
+        yield {}
+    finally:
+        await _CLIENT.aclose()
+
+
+# Retry budget for transient ComexStat failures: attempts, and seconds after which no new attempt starts (see _send)
+_RETRY_ATTEMPTS = 3
+_RETRY_MAX_DELAY = 60.0
+
+# Size of the byte chunks fed to the incremental JSON parser for streamed POST responses
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Initialize FastMCP server
+mcp = FastMCP("comexstat", lifespan=_lifespan)
+
+
+# Auxiliary tables and single items are reference data that rarely changes, so results are
+# cached in process. Searched/paged lookups expire quickly; plain table and item lookups last a day.
+_CACHE_TTL_SHORT = 60.0
+_CACHE_TTL_LONG = 24 * 60 * 60.0
+_CACHE_MAXSIZE = 1024
+_REFERENCE_CACHE: Dict[Tuple, Tuple[float, Any]] = {} # key -> (expires_at, value)
+
+
+def _cache_get(key: Tuple, allow_stale: bool = False) -> Any:
+    """
+    Returns the cached value for key, or None if missing or expired.
+    With allow_stale=True expired values are returned too (used as a fallback when the API fails).
+    """
+    entry = _REFERENCE_CACHE.get(key)
+    if entry is None:
+        return None
+    expires_at, value = entry
+    if allow_stale or time.monotonic() < expires_at:
+        return value
+    return None
+
+
+def _cache_set(key: Tuple, value: Any, ttl: float) -> None:
+    """Stores value for ttl seconds, evicting the oldest entry when the cache is full."""
+    if key not in _REFERENCE_CACHE and len(_REFERENCE_CACHE) >= _CACHE_MAXSIZE:
+        _REFERENCE_CACHE.pop(next(iter(_REFERENCE_CACHE)))
+    _REFERENCE_CACHE[key] = (time.monotonic() + ttl, value)
+
+
+@functools.lru_cache(maxsize=128)
+def _warn_unexpected_shape(path: str, what: str, type_name: str, expected: str = "an object") -> None:
+    """Logs an unexpected response shape once per (path, what, type) instead of on every call."""
+    logger.warning("Unexpected response shape from %s: %s is %s, expected %s.", path, what, type_name, expected)
+
+
+class _MissingRowList(ValueError):
+    """Raised by _iter_rows when a streamed response has no array under the extract keys."""
+
+
+def _extract(path: str, result: Any, extract: Tuple[str, ...]) -> Any:
+    """
+    Descends into result along the extract keys without ever raising on a schema mismatch.
+    A response that isn't an object yields None. Missing or null intermediate keys fall
+    through to a shared empty mapping (no per-call {} sentinel), so the leaf lookup yields
+    None; a non-object intermediate value (e.g. a "data" that already holds the list) is
+    returned as is.
+    """
+    if not isinstance(result, dict):
+        _warn_unexpected_shape(path, "the response body", type(result).__name__)
+        return None
+    *parents, leaf = extract
+    for key in parents:
+        node = result.get(key)
+        if isinstance(node, dict):
+            result = node
+            continue
+        _warn_unexpected_shape(path, repr(key), type(node).__name__)
+        if node is not None:
+            return node
+        result = _EMPTY
+    return result.get(leaf)
+
+
+def _is_transient(exc: BaseException) -> bool:
+    """Errors worth retrying: connection failures, read timeouts and 5xx responses."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout))
+
+
+async def _iter_rows(
+    method: str,
+    path: str,
+    params: Optional[Dict[str, Any]],
+    extract: Optional[Tuple[str, ...]],
+    extra: Dict[str, Any],
+) -> AsyncIterator[Any]:
+    """
+    Streams the response and yields the items of the list under `extract` as soon as
+    ijson has parsed them, so rows are available before the last byte arrives.
+    Raises on HTTP and parse errors (no retries: rows may already have been consumed),
+    and _MissingRowList when the list never appears: a body like {} or an error object
+    sent with status 200 is a failed lookup, not a result with zero rows.
+    """
+    async with _CLIENT.stream(method, path, params=params, **extra) as response:
+        if response.is_error:
+            await response.aread() # Load the (small) error body so .content/.text work in the error log
+        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+        events = ijson.sendable_list()
+        list_prefix = ".".join(extract or ())
+        parser = ijson.items_coro(events, f"{list_prefix}.item" if list_prefix else "item", use_float=True)
+        # A second (C-level) event parser only watches for the start of the list; it is fed
+        # until the list is found (normally within the first chunk) and then dropped
+        probe_events = ijson.sendable_list()
+        probe = ijson.parse_coro(probe_events)
+        has_list = False
+        previous_event = None
+        received = False
+        async for chunk in response.aiter_bytes(_STREAM_CHUNK_SIZE):
+            received = received or bool(chunk)
+            if not has_list:
+                probe.send(chunk)
+                for prefix, event, _ in probe_events:
+                    # The list itself, or a bare "[]" body: both mean zero rows (as _EMPTY_BODIES)
+                    if (prefix == list_prefix and event == "start_array") or (
+                        prefix == "" and event == "end_array" and previous_event == "start_array"
+                    ):
+                        has_list = True
+                        break
+                    previous_event = event
+                del probe_events[:]
+            parser.send(chunk)
+            for row in events:
+                yield row
+            del events[:]
+        if not received:
+            return # Empty body: zero rows, the same rule as _EMPTY_BODIES on the buffered path
+        parser.close() # Flushes the parser and raises if the document was truncated
+        for row in events:
+            yield row
+        if not has_list:
+            raise _MissingRowList(list_prefix)
+
+
+# Transient failures are retried here (up to 3 attempts, jittered exponential backoff)
+# instead of surfacing as None and making the LLM re-issue the whole tool call.
+# stop_after_delay only prevents *starting* another attempt once 60 s have passed; an
+# attempt already running is bounded by the client timeouts alone, so the worst case is
+# just under 60 s plus one full attempt. The last exception is re-raised so _request's
+# error handling sees it unchanged.
+@retry(
+    retry=retry_if_exception(_is_transient),
+    stop=stop_after_attempt(_RETRY_ATTEMPTS) | stop_after_delay(_RETRY_MAX_DELAY),
+    wait=wait_exponential_jitter(multiplier=0.2, max=2.0),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
+async def _send(
+    method: str,
+    path: str,
+    params: Optional[Dict[str, Any]],
+    extract: Optional[Tuple[str, ...]],
+    stream: bool,
+    extra: Dict[str, Any],
+) -> Any:
+    """Performs one HTTP attempt for _request and returns the extracted result; raises on errors."""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Sending %s request to %s", method, path)
+    if stream:
+        try:
+            rows = [row async for row in _iter_rows(method, path, params, extract, extra)]
+        except _MissingRowList as missing:
+            # Same outcome as the buffered path's _extract: None, so the tools report an error
+            _warn_unexpected_shape(path, repr(str(missing)), "missing", "an array")
+            return None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request to %s successful, streamed %d rows.", path, len(rows))
+        return rows
+
+    response = await _CLIENT.request(method, path, params=params, **extra)
+    response.raise_for_status()
+    body = response.content
+    if body in _EMPTY_BODIES:
+        # Zero-row answer: nothing to parse, skip the JSON decoder entirely
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request to %s returned an empty body.", path)
+        return [] if extract else None
+    result = orjson.loads(body) # Parse the raw bytes with orjson
+    if extract:
+        result = _extract(path, result, extract)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Request to %s successful.", path)
+    return result
+
+
+def _request_options(json: Optional[Dict[str, Any]], timeout: Optional[float]) -> Dict[str, Any]:
+    """Builds the extra httpx request arguments for an optional JSON body and timeout."""
+    extra: Dict[str, Any] = {} if timeout is None else {"timeout": timeout}
+    if json is not None:
+        # Serialize the body with orjson (UTF-8 bytes, no str round-trip) instead of httpx's json.dumps
+        extra["content"] = orjson.dumps(json)
+        extra["headers"] = _JSON_CONTENT_TYPE
+    return extra
+
+
+async def _request(
+    method: str,
+    path: str,
+    *,
+    json: Optional[Dict[str, Any]] = None,
+    params: Optional[Dict[str, Any]] = None,
+    extract: Optional[Tuple[str, ...]] = ("data", "list"),
+    stream: bool = False,
+    timeout: Optional[float] = None,
+) -> Any:
     """
-    Internal helper function to perform the HTTP request and basic error handling.
+    Internal helper shared by all tools: performs the HTTP request on the shared client,
+    parses the JSON body and returns the slice found under the `extract` keys.
+    All error handling lives here; on any failure the error is logged and None is returned.
+
+    With stream=True the body is parsed incrementally with ijson and only the items of
+    the list under `extract` are materialised - the full JSON tree of a large /general
+    or /cities answer is never held in memory at once. ijson picks its fastest installed
+    backend (yajl2_c when the compiled extension is available).
 
     Args:
-        url: The API endpoint URL.
-        payload: The request payload (body).
-        headers: The request headers.
+        method: HTTP method ("GET" or "POST").
+        path: The API endpoint path, relative to COMEXSTAT_API_BASE (e.g. "/general").
+        json: Optional request payload (body).
+        params: Optional query string parameters.
+        extract: Keys to descend into in the parsed response; None returns the whole body.
+        stream: Stream-parse the list under `extract` instead of loading the whole body.
+        timeout: Optional per-request timeout overriding the client default.
 
     Returns:
-        The parsed JSON response as a dictionary, or None if an error occurs.
+        The extracted part of the response (for stream=True, the list of rows, possibly
+        empty), or None if an error occurs.
     """
-    async with httpx.AsyncClient(verify=False) as client:
+    extra = _request_options(json, timeout)
+    try:
+        return await _send(method, path, params, extract, stream, extra)
+    except httpx.HTTPStatusError as exc:
+        if exc.response.status_code == 404:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Not found (404): %s %s", method, path)
+            return None
+        logger.warning("HTTP error occurred on %s %s: %s - %s", method, path, exc.response.status_code, exc.response.text)
         try:
-            print(f"Sending request to {url} with payload: {payload}") # Debug print
-            response = await client.post(url, json=payload, headers=headers, timeout=60.0) # Increased timeout
-            response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-            data = response.json()
-            print("Request successful, returning JSON data.")
-            return data
-        except httpx.HTTPStatusError as exc:
-            print(f"HTTP error occurred: {exc.response.status_code} - {exc.response.text}")
-            try:
-                print(f"Error details: {exc.response.json()}") # Try to print JSON error details
-            except Exception:
-                pass # Ignore if response body is not JSON
-        except httpx.RequestError as exc:
-            print(f"An error occurred while requesting {exc.request.url!r}: {exc}")
-        except Exception as e:
-            print(f"An unexpected error occurred during data fetching: {e}")
-        return None
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Error details: %s", orjson.loads(exc.response.content)) # Try to log JSON error details
+        except Exception:
+            pass # Ignore if response body is not JSON
+    except httpx.RequestError as exc:
+        logger.warning("An error occurred while requesting %r: %s", exc.request.url, exc)
+    except Exception as e:
+        # This catches JSON decoding errors, unexpected response shapes, etc.
+        logger.warning("An unexpected error occurred during %s %s: %s", method, path, e)
+    return None
     
 
+def _check_table_name(table_name: str) -> None:
+    """Rejects unknown auxiliary tables before a request is made for them."""
+    if table_name not in _VALID_TABLES:
+        raise ValueError(f"Unknown table_name {table_name!r}: expected one of {sorted(_VALID_TABLES)}.")
+
+
+def _trade_payload(
+    flow: str,
+    monthDetail: bool,
+    period: Optional[Dict[str, str]],
+    filters: Optional[List[Dict[str, Any]]],
+    details: Optional[List[str]],
+    metrics: Optional[List[str]],
+) -> Dict[str, Any]:
+    """Builds the POST body shared by the /general and /cities endpoints."""
+    if flow not in _VALID_FLOWS:
+        raise ValueError(f"Invalid flow {flow!r}: expected one of {sorted(_VALID_FLOWS)}.")
+    if period is None:
+        period = _DEFAULT_PERIOD
+
+    # Modify details: remove 'year' if present (only rebuild the list when it is actually there)
+    if details is None:
+        details = []
+    elif 'year' in details:
+        details = [d for d in details if d != 'year']
+
+    # Construct payload using potentially modified arguments
+    return {
+        "flow": flow,
+        "monthDetail": monthDetail,
+        "period": dict(period), # Plain dict copy (MappingProxyType is not JSON serializable)
+        "filters": filters, # Use modified filters
+        "details": details, # Use modified details
+        "metrics": metrics if metrics is not None else []
+    }
+
+
+async def stream_dados_gerais(
+    flow: str = "import",
+    monthDetail: bool = False,
+    period: Optional[Dict[str, str]] = None,
+    filters: Optional[List[Dict[str, Any]]] = None,
+    details: Optional[List[str]] = None,
+    metrics: Optional[List[str]] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of dados_gerais for in-process callers: yields each row of the
+    /general answer as soon as it is parsed instead of returning the whole list.
+    Same arguments as dados_gerais. Errors are raised, not logged (and not retried).
+    """
+    payload = _trade_payload(flow, monthDetail, period, filters, details, metrics)
+    async for row in _iter_rows("POST", _URL_GENERAL, None, ("data", "list"), _request_options(payload, None)):
+        yield row
+
+
+async def stream_dados_municipio(
+    flow: str = "export",
+    monthDetail: bool = False,
+    period: Optional[Dict[str, str]] = None,
+    filters: Optional[List[Dict[str, Any]]] = None,
+    details: Optional[List[str]] = None,
+    metrics: Optional[List[str]] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of dados_municipio for in-process callers: yields each row of the
+    /cities answer as soon as it is parsed. Same arguments as dados_municipio.
+    Errors are raised, not logged (and not retried).
+    """
+    payload = _trade_payload(flow, monthDetail, period, filters, details, metrics)
+    async for row in _iter_rows("POST", _URL_CITIES, None, ("data", "list"), _request_options(payload, None)):
+        yield row
+
+
 @mcp.tool()
 async def dados_gerais(
     flow: str = "import",
     monthDetail: bool = False,
-    period: Dict[str, str] = {"from": "2024-01", "to": "2024-12"},
+    period: Optional[Dict[str, str]] = None,
     filters: Optional[List[Dict[str, Any]]] = None,
     details: Optional[List[str]] = None,
     metrics: Optional[List[str]] = None
@@ -111,37 +498,20 @@ async def dados_gerais(
         Optional[Dict[str, Any]]: Um dicionário contendo os dados buscados em sua estrutura JSON original
                                   (especificamente a lista sob a chave 'data'), ou None se ocorrer um erro.
     """
-    url = f"{COMEXSTAT_API_BASE}/general" # Ensure the endpoint path starts with /
-
-    # Modify details: remove 'year' if present using list comprehension
-    details = [d for d in (details if details is not None else []) if d != 'year']
-
-    # Construct payload using potentially modified arguments
-    payload = {
-        "flow": flow,
-        "monthDetail": monthDetail,
-        "period": period,
-        "filters": filters, # Use modified filters
-        "details": details, # Use modified details
-        "metrics": metrics if metrics is not None else []
-    }
-
-
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "User-Agent": USER_AGENT  # Use the defined User-Agent
-    }
+    path = _URL_GENERAL
+    payload = _trade_payload(flow, monthDetail, period, filters, details, metrics)
 
-    # Call the helper function to fetch data
-    data = await _fetch_comexstat_data(url, payload, headers)
+    # Call the helper function to fetch data (headers are set on the shared client)
+    data = await _request("POST", path, json=payload, stream=True)
 
-    if data:
-        print("Data fetched successfully, returning raw JSON structure.")
-        return data.get("data", {}).get("list")  # Return the 'data' key if it exists, else return an empty dict
+    if data is not None:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Data fetched successfully, returning rows.")
+        return data # Already the "data.list" rows, extracted while streaming
     else:
-        # _fetch_comexstat_data already prints errors
-        print("Returning None due to fetch error.")
+        # _request already logs errors
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Returning None due to fetch error.")
         return None
 
 
@@ -150,7 +520,7 @@ async def dados_gerais(
 async def dados_municipio(
     flow: str = "export",
     monthDetail: bool = False,
-    period: Dict[str, str] = {"from": "2024-01", "to": "2024-12"},
+    period: Optional[Dict[str, str]] = None,
     filters: Optional[List[Dict[str, Any]]] = None,
     details: Optional[List[str]] = None,
     metrics: Optional[List[str]] = None
@@ -195,41 +565,20 @@ async def dados_municipio(
         Optional[Dict[str, Any]]: Um dicionário contendo os dados buscados em sua estrutura JSON original
                                   (especificamente a lista sob a chave 'data'), ou None se ocorrer um erro.
     """
-    url = f"{COMEXSTAT_API_BASE}/cities" # Endpoint for city data
-
-    # Modify details: remove 'year' if present using list comprehension
-    details = [d for d in (details if details is not None else []) if d != 'year']
-
-
-    # Construct payload using potentially modified arguments
-    payload = {
-        "flow": flow,
-        "monthDetail": monthDetail,
-        "period": period,
-        "filters": filters, # Use modified filters
-        "details": details, # Use modified details
-        "metrics": metrics if metrics is not None else []
-    }
-
+    path = _URL_CITIES
+    payload = _trade_payload(flow, monthDetail, period, filters, details, metrics)
 
+    # Call the helper function to fetch data (headers are set on the shared client)
+    data = await _request("POST", path, json=payload, stream=True)
 
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "User-Agent": USER_AGENT
-    }
-
-    # Call the helper function to fetch data
-    data = await _fetch_comexstat_data(url, payload, headers)
-
-    if data:
-        # Return the relevant part of the JSON response
-        # Adjust data.get("data", {}).get("list") if the structure is different
-        print("City data fetched successfully, returning raw JSON structure.")
-        return data.get("data", {}).get("list") # Return the list part of the data
+    if data is not None:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("City data fetched successfully, returning rows.")
+        return data # Already the "data.list" rows, extracted while streaming
     else:
-        # _fetch_comexstat_data already prints errors
-        print("Returning None due to fetch error for city data.")
+        # _request already logs errors
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Returning None due to fetch error for city data.")
         return None
 
 # Example usage for dados_municipio (assuming async context)
@@ -312,19 +661,12 @@ async def fetch_auxiliary_table(
         Optional[Dict[str, Any]]: Um dicionário contendo os dados da tabela em sua estrutura JSON original,
                                   ou None se ocorrer um erro.
     """
-    url = f"{COMEXSTAT_API_BASE}/tables/{table_name}"
-    headers = {
-        "Accept": "application/json",
-        "User-Agent": USER_AGENT
-    }
-
-    # Define which tables support which parameters
-    params_all = {"product-categories", "ncm", "hs", "nbm", "classifications"}
-    params_limited = {"economic-blocks"}
+    _check_table_name(table_name)
+    path = f"/tables/{table_name}"
 
     # Build query parameters dictionary
     query_params: Dict[str, Any] = {}
-    if table_name in params_all or table_name in params_limited:
+    if table_name in _PARAMS_ALL or table_name in _PARAMS_LIMITED:
         if add is not None:
             query_params["add"] = add
         if language is not None:
@@ -332,31 +674,38 @@ async def fetch_auxiliary_table(
         if search is not None:
             query_params["search"] = search
 
-    if table_name in params_all:
+    if table_name in _PARAMS_ALL:
         if page is not None:
             query_params["page"] = page
         if perPage is not None:
             query_params["perPage"] = perPage
 
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            print(f"Fetching '{table_name}' table from {url} with params: {query_params}") # Debug print
-            response = await client.get(url, headers=headers, params=query_params, timeout=60.0) # Pass params here
-            response.raise_for_status()
-            data = response.json()
-            print(f"'{table_name}' table data received, returning raw JSON structure.")
-            return data.get("data").get("list") # Return the raw JSON data
-
-        except httpx.HTTPStatusError as exc:
-            print(f"HTTP error occurred while fetching '{table_name}' table: {exc.response.status_code} - {exc.response.text}")
-        except httpx.RequestError as exc:
-            print(f"An error occurred while requesting '{table_name}' table {exc.request.url!r}: {exc}")
-        except Exception as e:
-            # This catches JSON decoding errors, etc.
-            print(f"An unexpected error occurred during '{table_name}' table fetching: {e}")
+    cache_key = (table_name, frozenset(query_params.items()))
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Returning cached '%s' table data.", table_name)
+        return cached
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Fetching '%s' table from %s", table_name, path)
+    table_list = await _request("GET", path, params=query_params) # Pass params here
+    if table_list is not None:
+        is_search = "search" in query_params or "page" in query_params
+        # A plain table is never legitimately empty: don't let an empty answer replace a good entry
+        if table_list or is_search:
+            _cache_set(cache_key, table_list, _CACHE_TTL_SHORT if is_search else _CACHE_TTL_LONG)
+        return table_list
+
+    # Serve the last known result, even if expired, rather than failing the lookup
+    stale = _cache_get(cache_key, allow_stale=True)
+    if stale is not None:
+        logger.warning("Returning stale cached '%s' table data after fetch error.", table_name)
+        return stale
 
     # Return None if fetching failed
-    print(f"Returning None for '{table_name}' table due to previous errors.")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Returning None for '%s' table due to previous errors.", table_name)
     return None
 
 
@@ -390,47 +739,134 @@ async def fetch_single_item_detail(table_name: str, item_id: Any) -> Optional[Di
         Optional[Dict[str, Any]]: Um dicionário contendo os detalhes do item em sua estrutura JSON original,
                                   ou None se ocorrer um erro ou o item não for encontrado.
     """
-    url = f"{COMEXSTAT_API_BASE}/tables/{table_name}/{item_id}"
-    headers = {
-        "Accept": "application/json",
-        "User-Agent": USER_AGENT
-    }
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            print(f"Fetching detail for item '{item_id}' from '{table_name}' table at {url}")
-            response = await client.get(url, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            data = response.json()
-            print(f"Detail for item '{item_id}' received, extracting item data.")
-            item_data = None
-            # Check if the response itself is the data dictionary
-            if isinstance(data, dict):
-                 # Check if there's a 'data' key containing the actual item dictionary
-                if 'data' in data and isinstance(data['data'], dict):
-                    item_data = data['data']
-                else:
-                    # Assume the top-level dictionary is the item data if 'data' key isn't present or isn't a dict
-                    # This might need adjustment based on actual API response structure for single items
-                    item_data = data
-            if item_data:
-                print(f"Detail for item '{item_id}' successfully extracted.")
-                return item_data # Return the dictionary directly
-            else:
-                print(f"Could not extract item data dictionary from the response for '{table_name}/{item_id}'.")
-                print(f"Response JSON structure: {data}")
-        except httpx.HTTPStatusError as exc:
-            if exc.response.status_code == 404:
-                print(f"Item '{item_id}' not found in '{table_name}' table (404).")
-            else:
-                print(f"HTTP error occurred while fetching detail for '{table_name}/{item_id}': {exc.response.status_code} - {exc.response.text}")
-        except httpx.RequestError as exc:
-            print(f"An error occurred while requesting detail for '{table_name}/{item_id}' {exc.request.url!r}: {exc}")
-        except Exception as e:
-            print(f"An unexpected error occurred during detail fetching or processing for '{table_name}/{item_id}': {e}")
-    print(f"Returning None for detail of '{table_name}/{item_id}' due to previous errors.")
+    _check_table_name(table_name)
+    cache_key = ("item", table_name, str(item_id))
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Returning cached detail for item '%s' from '%s' table.", item_id, table_name)
+        return cached
+
+    # Concurrent lookups are coalesced into batches (and duplicates share one request).
+    # shield() keeps one caller's cancellation from cancelling the shared result.
+    return await asyncio.shield(_ITEM_BATCHER.submit(table_name, item_id))
+
+
+async def _fetch_item_detail(table_name: str, item_id: Any) -> Optional[Dict[str, Any]]:
+    """
+    Internal helper: performs the GET for a single auxiliary-table item, caches the
+    result and falls back to a stale cached copy on errors. Called by _ItemDetailBatcher.
+    """
+    path = f"/tables/{table_name}/{item_id}"
+    cache_key = ("item", table_name, str(item_id))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Fetching detail for item '%s' from '%s' table at %s", item_id, table_name, path)
+    data = await _request("GET", path, extract=None, timeout=30.0)
+    item_data = None
+    # Check if the response itself is the data dictionary
+    if isinstance(data, dict):
+         # Check if there's a 'data' key containing the actual item dictionary
+        if 'data' in data and isinstance(data['data'], dict):
+            item_data = data['data']
+        else:
+            # Assume the top-level dictionary is the item data if 'data' key isn't present or isn't a dict
+            # This might need adjustment based on actual API response structure for single items
+            item_data = data
+    if item_data:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Detail for item '%s' successfully extracted.", item_id)
+        _cache_set(cache_key, item_data, _CACHE_TTL_LONG)
+        return item_data # Return the dictionary directly
+    if data is not None:
+        logger.warning("Could not extract item data dictionary from the response for '%s/%s'.", table_name, item_id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Response JSON structure: %s", data)
+    stale = _cache_get(cache_key, allow_stale=True)
+    if stale is not None:
+        logger.warning("Returning stale cached detail for '%s/%s' after fetch error.", table_name, item_id)
+        return stale
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Returning None for detail of '%s/%s' due to previous errors.", table_name, item_id)
     return None
 
 
+class _ItemDetailBatcher:
+    """
+    Coalesces concurrent item-detail lookups. Calls arriving within `max_wait` seconds
+    (or until `max_batch_size` distinct items are queued) are dispatched together with
+    asyncio.gather, so they go out as parallel streams on the shared HTTP/2 connection.
+    A lookup already queued or in flight is not requested twice: later callers await
+    the same future.
+    """
+
+    def __init__(self, fetch, max_batch_size: int = 32, max_wait: float = 0.01):
+        self._fetch = fetch
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._pending: Dict[Tuple[str, str], Tuple[str, Any]] = {}  # queued, not yet dispatched
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}  # queued or dispatched
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()  # Strong references to running batches
+
+    def submit(self, table_name: str, item_id: Any) -> asyncio.Future:
+        key = (table_name, str(item_id))
+        future = self._inflight.get(key)
+        if future is not None:
+            return future
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[key] = future
+        self._pending[key] = (table_name, item_id)
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._max_wait, self._flush)
+        return future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: Dict[Tuple[str, str], Tuple[str, Any]]) -> None:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Dispatching batch of %d item-detail lookups.", len(batch))
+        results = await asyncio.gather(
+            *(self._fetch(table_name, item_id) for table_name, item_id in batch.values()),
+            return_exceptions=True,
+        )
+        for key, result in zip(batch, results):
+            future = self._inflight.pop(key)
+            if future.done():
+                continue
+            if isinstance(result, asyncio.CancelledError):
+                future.cancel()
+            elif isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+_ITEM_BATCHER = _ItemDetailBatcher(_fetch_item_detail)
+
+
 if __name__ == "__main__":
-    # Initialize and run the server
-    mcp.run(transport='stdio')
\ No newline at end of file
+    # Run the server on uvloop when available: its libuv-based loop has less per-await and
+    # per-socket overhead for the many small HTTPS requests made here. mcp.run() is just
+    # anyio.run(mcp.run_stdio_async); asking anyio for uvloop avoids uvloop.install(), which
+    # is deprecated on Python 3.12+. uvloop does not support Windows, where the default
+    # asyncio loop is kept.
+    try:
+        if sys.platform == "win32":
+            raise ImportError
+        import uvloop  # noqa: F401
+    except ImportError:
+        # Initialize and run the server
+        mcp.run(transport='stdio')
+    else:
+        anyio.run(mcp.run_stdio_async, backend_options={"use_uvloop": True})